@@ -1,10 +1,21 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel,Field
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
 from dotenv import load_dotenv
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 import os
+import asyncio
 import re
-from typing import Dict, Any, Union, List
+import time
+import hashlib
+import msgspec
+from collections import OrderedDict
+from typing import Annotated, Any, Dict, List, Optional, Tuple, Union
+
+from report_models import ReportOut
+from report_parser import StreamingReportParser, parse_medical_report, split_patient_reports
 
 
 # ---------------- Initialize ----------------
@@ -22,158 +33,153 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 MODEL_ID = "gemini-2.5-flash"
 
+# ✅ Shared model instance (reused across requests)
+model = genai.GenerativeModel(MODEL_ID)
+
+# ✅ Cap on concurrent Gemini calls per worker (keeps bursts under the provider rate limit)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+_GEMINI_SEM = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+# ✅ Optional sampling temperature (0 makes reports deterministic and cacheable)
+GEMINI_TEMPERATURE = os.getenv("GEMINI_TEMPERATURE")
+GENERATION_CONFIG = {"temperature": float(GEMINI_TEMPERATURE)} if GEMINI_TEMPERATURE else None
+
+# ✅ /predict_batch limits: patients per Gemini call, and patients per request
+BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "64"))
+if BATCH_SIZE < 1 or BATCH_MAX_ITEMS < 1:
+    raise ValueError("❌ GEMINI_BATCH_SIZE and BATCH_MAX_ITEMS must be at least 1.")
+
 
 # ---------------- Schema ----------------
-class BiomarkerRequest(BaseModel):
-    albumin: float = Field(default=3.2, description="Albumin level in g/dL")
-    creatinine: float = Field(default=1.4, description="Creatinine level in mg/dL")
-    glucose: float = Field(default=145, description="Glucose level in mg/dL")
-    crp: float = Field(default=12.0, description="C-reactive protein in mg/L")
-    mcv: float = Field(default=88, description="Mean corpuscular volume in fL")
-    rdw: float = Field(default=15.5, description="Red cell distribution width in %")
-    alp: float = Field(default=120, description="Alkaline phosphatase in U/L")
-    wbc: float = Field(default=11.8, description="White blood cell count in ×10^3/μL")
-    lymphocytes: float = Field(default=20, description="Lymphocyte percentage")
-    hb: float = Field(default=13.0, description="Hemoglobin in g/dL")
-    pv: float = Field(default=2.1, description="Plasma volume in L (converted internally if needed)")
-    age: int = Field(default=52, description="Patient age in years")
-    gender: str = Field(default="female", description="Gender of the patient")
-    height: float = Field(default=165, description="Height in cm")
-    weight: float = Field(default=70, description="Weight in kg")
-
-
-# ---------------- Cleaning Utility ----------------
-def clean_json(data: Union[Dict, List, str]) -> Union[Dict, List, str]:
-    """Recursively removes separators, extra whitespace, and artifacts from all string values."""
-    if isinstance(data, str):
-        text = re.sub(r"-{3,}", "", data)
-        text = re.sub(r"\s+", " ", text)
-        text = text.strip(" -\n\t\r")
-        return text
-    elif isinstance(data, list):
-        return [clean_json(i) for i in data if i and clean_json(i)]
-    elif isinstance(data, dict):
-        return {k.strip(): clean_json(v) for k, v in data.items()}
-    return data
-
-
-# ---------------- Parser ----------------
-def parse_medical_report(text: str):
-    """
-    Parses Gemini markdown response → structured JSON.
-    Detects section headers, **bold keys**, and table entries.
-    """
-    def clean_line(line: str) -> str:
-        return re.sub(r"[\-\*\u2022]+\s*", "", line.strip())
-
-    def parse_bold_entities(block: str) -> Dict[str, str]:
-        """Extracts **bold** entities and maps text until next bold or section."""
-        entities = {}
-        pattern = re.compile(r"\*\*(.*?)\*\*(.*?)(?=\*\*|###|$)", re.S)
-        for match in pattern.finditer(block):
-            key = match.group(1).strip().strip(":")
-            val = match.group(2).strip().replace("\n", " ")
-            val = re.sub(r"\s+", " ", val)
-            if key:
-                entities[key] = val
-        return entities
-
-    data = {
-        "executive_summary": {"top_priorities": [], "key_strengths": []},
-        "system_analysis": {},
-        "personalized_action_plan": {},
-        "interaction_alerts": [],
-        "normal_ranges": {},
-        "biomarker_table": []
-    }
-
-    # --- Executive Summary ---
-    exec_match = re.search(r"###\s*Executive Summary(.*?)(?=###|$)", text, re.S | re.I)
-    if exec_match:
-        block = exec_match.group(1)
-        priorities = re.findall(r"\d+\.\s*(.*?)\n", block)
-        if priorities:
-            data["executive_summary"]["top_priorities"] = [clean_line(p) for p in priorities]
-        strengths_match = re.search(r"\*\*Key Strengths:\*\*(.*)", block, re.S)
-        if strengths_match:
-            strengths_text = strengths_match.group(1)
-            strengths = [clean_line(s) for s in strengths_text.splitlines() if clean_line(s)]
-            data["executive_summary"]["key_strengths"] = strengths
-
-    # --- System Analysis ---
-    sys_match = re.search(r"###\s*System[- ]Specific Analysis(.*?)(?=###|$)", text, re.S | re.I)
-    if sys_match:
-        sys_block = sys_match.group(1)
-        data["system_analysis"] = parse_bold_entities(sys_block)
-
-    # --- Personalized Action Plan ---
-    plan_match = re.search(r"###\s*Personalized Action Plan(.*?)(?=###|$)", text, re.S | re.I)
-    if plan_match:
-        plan_block = plan_match.group(1)
-        data["personalized_action_plan"] = parse_bold_entities(plan_block)
-
-    # --- Interaction Alerts ---
-    alerts_match = re.search(r"###\s*Interaction Alerts(.*?)(?=###|$)", text, re.S | re.I)
-    if alerts_match:
-        alerts_block = alerts_match.group(1)
-        alerts = [clean_line(a) for a in alerts_block.splitlines() if clean_line(a)]
-        data["interaction_alerts"] = alerts
-
-    # --- Normal Ranges ---
-    normal_match = re.search(r"###\s*Normal Ranges(.*?)(?=###|$)", text, re.S | re.I)
-    if normal_match:
-        normal_block = normal_match.group(1)
-        for match in re.findall(r"-\s*([^:]+):\s*([^\n]+)", normal_block):
-            biomarker, rng = match
-            data["normal_ranges"][biomarker.strip()] = rng.strip()
-
-    # --- Tabular Mapping ---
-    table_match = re.search(r"###\s*Tabular Mapping(.*)", text, re.S | re.I)
-    if table_match:
-        table_block = table_match.group(1)
-        # robust row matcher: capture any table rows with 5 pipe-separated columns
-        table_pattern = r"\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|"
-        for biomarker, value, status, insight, ref in re.findall(table_pattern, table_block):
-            # normalize
-            biomarker_s = biomarker.strip()
-            value_s = value.strip()
-            status_s = status.strip()
-            insight_s = insight.strip()
-            ref_s = ref.strip()
-
-            # ---------- ONLY SKIP rows where ALL five fields are empty ----------
-            if not any([biomarker_s, value_s, status_s, insight_s, ref_s]):
-                # This is the empty-row you showed: skip it and continue
-                continue
-
-            # ---------- ALSO SKIP rows that are pure separator artifacts ----------
-            # e.g., ":-----------" or "--------" in biomarker column (common AI artifacts)
-            def is_separator_cell(s: str) -> bool:
-                # treat as separator if contains no alphanumeric chars
-                return not bool(re.search(r"[A-Za-z0-9]", s))
-
-            if all(is_separator_cell(c) for c in [biomarker_s, value_s, status_s, insight_s, ref_s]):
-                continue
-
-            # ---------- Append the cleaned/valid row ----------
-            data["biomarker_table"].append({
-                "biomarker": biomarker_s,
-                "value": value_s,
-                "status": status_s,
-                "insight": insight_s,
-                "reference_range": ref_s,
-            })
-
-    return data
+class BiomarkerRequest(msgspec.Struct):
+    albumin: Annotated[float, msgspec.Meta(description="Albumin level in g/dL")] = 3.2
+    creatinine: Annotated[float, msgspec.Meta(description="Creatinine level in mg/dL")] = 1.4
+    glucose: Annotated[float, msgspec.Meta(description="Glucose level in mg/dL")] = 145
+    crp: Annotated[float, msgspec.Meta(description="C-reactive protein in mg/L")] = 12.0
+    mcv: Annotated[float, msgspec.Meta(description="Mean corpuscular volume in fL")] = 88
+    rdw: Annotated[float, msgspec.Meta(description="Red cell distribution width in %")] = 15.5
+    alp: Annotated[float, msgspec.Meta(description="Alkaline phosphatase in U/L")] = 120
+    wbc: Annotated[float, msgspec.Meta(description="White blood cell count in ×10^3/μL")] = 11.8
+    lymphocytes: Annotated[float, msgspec.Meta(description="Lymphocyte percentage")] = 20
+    hb: Annotated[float, msgspec.Meta(description="Hemoglobin in g/dL")] = 13.0
+    pv: Annotated[float, msgspec.Meta(description="Plasma volume in L (converted internally if needed)")] = 2.1
+    age: Annotated[int, msgspec.Meta(description="Patient age in years")] = 52
+    gender: Annotated[str, msgspec.Meta(description="Gender of the patient")] = "female"
+    height: Annotated[float, msgspec.Meta(description="Height in cm")] = 165
+    weight: Annotated[float, msgspec.Meta(description="Weight in kg")] = 70
+
+
+# Lax mode also accepts numeric strings such as "3.2".
+_BIOMARKER_DECODER = msgspec.json.Decoder(BiomarkerRequest, strict=False)
+_BIOMARKER_SCHEMA = msgspec.json.schema_components([BiomarkerRequest])[1]["BiomarkerRequest"]
+
+
+# msgspec reports the failing field as a trailing "- at `$.age`" / "- at `$[0].age`"
+_ERROR_PATH_RE = re.compile(r" - at `\$([^`]*)`$")
+_PATH_PART_RE = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+
+
+def _body_validation_error(e: msgspec.DecodeError) -> RequestValidationError:
+    """Wraps a msgspec decode error so FastAPI returns its standard per-field 422 error list."""
+    msg = str(e)
+    loc: List[Union[str, int]] = ["body"]
+    path = _ERROR_PATH_RE.search(msg)
+    if path:
+        msg = msg[:path.start()]
+        for key, index in _PATH_PART_RE.findall(path.group(1)):
+            loc.append(int(index) if index else key)
+    return RequestValidationError([{"loc": tuple(loc), "msg": msg, "type": "value_error"}])
+
+
+async def decode_biomarkers(request: Request) -> BiomarkerRequest:
+    """Decodes the raw request body straight into a BiomarkerRequest struct."""
+    try:
+        return _BIOMARKER_DECODER.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise _body_validation_error(e)
 
 
-# ---------------- Endpoint ----------------
-@app.post("/predict")
-def predict(data: BiomarkerRequest):
-    """Accepts biomarker input and returns structured medical insights."""
+_BATCH_DECODER = msgspec.json.Decoder(
+    Annotated[List[BiomarkerRequest], msgspec.Meta(min_length=1, max_length=BATCH_MAX_ITEMS)], strict=False
+)
+_BATCH_SCHEMA = {"type": "array", "items": _BIOMARKER_SCHEMA, "minItems": 1, "maxItems": BATCH_MAX_ITEMS}
+
+
+async def decode_biomarker_batch(request: Request) -> List[BiomarkerRequest]:
+    """Decodes the raw request body into a list of 1..BATCH_MAX_ITEMS BiomarkerRequest structs."""
     try:
-        # --- Prompt Template ---
-        prompt = """
+        return _BATCH_DECODER.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise _body_validation_error(e)
+
+
+# ---------------- Response Cache ----------------
+# Gemini output is only reused when generation is deterministic (temperature 0).
+CACHE_ENABLED = GENERATION_CONFIG is not None and GENERATION_CONFIG["temperature"] == 0
+CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "256"))
+CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "3600"))
+REDIS_URL = os.getenv("REDIS_URL")
+
+# In-process LRU: key → (expiry timestamp, report text)
+_CACHE: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+# Optional Redis backend shares cached reports across workers
+_redis = None
+if CACHE_ENABLED and REDIS_URL:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+
+    _redis = aioredis.from_url(REDIS_URL)
+
+
+def _cache_key(data: BiomarkerRequest) -> str:
+    """Hashes the canonical JSON of the request into a cache key."""
+    digest = hashlib.blake2b(msgspec.json.encode(data), digest_size=16).hexdigest()
+    return f"report:{MODEL_ID}:{digest}"
+
+
+def _cache_store_local(key: str, text: str) -> None:
+    _CACHE[key] = (time.monotonic() + CACHE_TTL, text)
+    _CACHE.move_to_end(key)
+    while len(_CACHE) > CACHE_SIZE:
+        _CACHE.popitem(last=False)
+
+
+async def cache_get(key: str) -> Optional[str]:
+    """Returns the cached report text for key, checking memory first, then Redis."""
+    entry = _CACHE.get(key)
+    if entry is not None:
+        expires, text = entry
+        if expires > time.monotonic():
+            _CACHE.move_to_end(key)
+            return text
+        del _CACHE[key]
+
+    if _redis is not None:
+        try:
+            cached = await _redis.get(key)
+        except RedisError:
+            return None
+        if cached is not None:
+            text = cached.decode("utf-8")
+            _cache_store_local(key, text)
+            return text
+    return None
+
+
+async def cache_set(key: str, text: str) -> None:
+    """Stores report text in memory and, when configured, in Redis."""
+    _cache_store_local(key, text)
+    if _redis is not None:
+        try:
+            await _redis.set(key, text, ex=CACHE_TTL)
+        except RedisError:
+            pass
+
+
+# ---------------- Prompt Templates ----------------
+PROMPT_TEMPLATE = """
 You are an advanced **Medical Insight Generation AI** trained to analyze **biomarkers and lab results**.
 
 ⚠️ IMPORTANT — OUTPUT FORMAT INSTRUCTIONS:
@@ -233,44 +239,169 @@ Status: Elevated ALP. Explanation: ...
 ------------------------------
 """
 
-        # --- Format User Data ---
-        user_message = f"""
+USER_TEMPLATE = """
 Patient Info:
-- Age: {data.age}
-- Gender: {data.gender}
-- Height: {data.height} cm
-- Weight: {data.weight} kg
+- Age: {age}
+- Gender: {gender}
+- Height: {height} cm
+- Weight: {weight} kg
 
 Biomarkers:
-- Albumin: {data.albumin} g/dL
-- Creatinine: {data.creatinine} mg/dL
-- Glucose: {data.glucose} mg/dL
-- CRP: {data.crp} mg/L
-- MCV: {data.mcv} fL
-- RDW: {data.rdw} %
-- ALP: {data.alp} U/L
-- WBC: {data.wbc} x10^3/μL
-- Lymphocytes: {data.lymphocytes} %
-- Hemoglobin: {data.hb} g/dL
-- Plasma Volume (PV): {data.pv} mL
+- Albumin: {albumin} g/dL
+- Creatinine: {creatinine} mg/dL
+- Glucose: {glucose} mg/dL
+- CRP: {crp} mg/L
+- MCV: {mcv} fL
+- RDW: {rdw} %
+- ALP: {alp} U/L
+- WBC: {wbc} x10^3/μL
+- Lymphocytes: {lymphocytes} %
+- Hemoglobin: {hb} g/dL
+- Plasma Volume (PV): {pv} mL
+"""
+
+BATCH_TEMPLATE = """
+The input contains {count} patients, numbered 1 to {count}.
+Write one complete report per patient, in the same order.
+Start each report with a line "### Patient <number>", followed by every section of the structure above.
 """
 
-        # --- Gemini Call ---
-        model = genai.GenerativeModel(MODEL_ID)
-        response = model.generate_content(f"{prompt}\n\n{user_message}")
+# Full Gemini prompt; str.format fills the patient fields in a single pass.
+_FULL_TMPL = f"{PROMPT_TEMPLATE}\n\n{USER_TEMPLATE}"
+
+
+# ---------------- Gemini Helpers ----------------
+_FINISH_STOP = genai.protos.Candidate.FinishReason.STOP
+
+# Backs off and retries when Gemini answers HTTP 429
+_retry_on_rate_limit = retry(
+    retry=retry_if_exception_type(ResourceExhausted),
+    wait=wait_random_exponential(multiplier=1, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True,
+)
+
+
+@_retry_on_rate_limit
+async def generate_report(prompt: str) -> str:
+    """Sends a prompt to Gemini and returns the stripped markdown report."""
+    async with _GEMINI_SEM:
+        response = await model.generate_content_async(prompt, generation_config=GENERATION_CONFIG)
+
+    if not response or not getattr(response, "text", None):
+        raise ValueError("Empty response from Gemini model.")
 
-        if not response or not getattr(response, "text", None):
-            raise ValueError("Empty response from Gemini model.")
+    return response.text.strip()
 
-        report_text = response.text.strip()
 
-        # --- Parse + Clean ---
-        parsed_output = parse_medical_report(report_text)
-        cleaned_output = clean_json(parsed_output)
+@_retry_on_rate_limit
+async def stream_report(prompt: str) -> Tuple[str, ReportOut]:
+    """Streams a Gemini report, parsing each section as it completes; returns (text, parsed report)."""
+    parser = StreamingReportParser()
+    last_chunk = None
+    async with _GEMINI_SEM:
+        response = await model.generate_content_async(prompt, generation_config=GENERATION_CONFIG, stream=True)
+        async for chunk in response:
+            last_chunk = chunk
+            if chunk.parts:
+                parser.feed(chunk.text)
 
-        return cleaned_output
+    # a SAFETY/RECITATION/MAX_TOKENS stop leaves a partial report: fail instead of returning or caching it
+    finish_reason = last_chunk.candidates[0].finish_reason if last_chunk and last_chunk.candidates else None
+    if finish_reason != _FINISH_STOP:
+        raise ValueError(f"Gemini stopped before completing the report (finish reason: {getattr(finish_reason, 'name', finish_reason)}).")
+
+    report_text = parser.text.strip()
+    if not report_text:
+        raise ValueError("Empty response from Gemini model.")
+
+    return report_text, parser.close()
+
+
+async def predict_chunk(items: List[BiomarkerRequest]) -> List[ReportOut]:
+    """Generates reports for up to BATCH_SIZE patients with a single Gemini call."""
+    patients = "\n".join(
+        f"### Patient {i}\n" + USER_TEMPLATE.format(**msgspec.structs.asdict(item))
+        for i, item in enumerate(items, start=1)
+    )
+    prompt = f"{PROMPT_TEMPLATE}\n\n{BATCH_TEMPLATE.format(count=len(items))}\n{patients}"
+    report_text = await generate_report(prompt)
+    return [parse_medical_report(report) for report in split_patient_reports(report_text, len(items))]
+
+
+# ---------------- Endpoint ----------------
+# Reports are encoded straight to JSON bytes; no jsonable_encoder walk on the way out
+_REPORT_ENCODER = msgspec.json.Encoder()
+
+
+def _inline_refs(node: Any, components: Dict[str, Any]) -> Any:
+    """Replaces msgspec "$ref" entries with the referenced schema so it can sit inside an operation."""
+    if isinstance(node, dict):
+        if "$ref" in node:
+            return _inline_refs(components[node["$ref"].rsplit("/", 1)[-1]], components)
+        return {k: _inline_refs(v, components) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_inline_refs(v, components) for v in node]
+    return node
+
+
+(_report_ref,), _report_components = msgspec.json.schema_components([ReportOut])
+_REPORT_SCHEMA = _inline_refs(_report_ref, _report_components)
+_REPORT_RESPONSES = {200: {"content": {"application/json": {"schema": _REPORT_SCHEMA}}}}
+_BATCH_RESPONSES = {200: {"content": {"application/json": {"schema": {"type": "array", "items": _REPORT_SCHEMA}}}}}
+
+
+@app.post(
+    "/predict",
+    response_class=Response,
+    responses=_REPORT_RESPONSES,
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": _BIOMARKER_SCHEMA}}}},
+)
+async def predict(data: BiomarkerRequest = Depends(decode_biomarkers)):
+    """Accepts biomarker input and returns structured medical insights."""
+    try:
+        # --- Cache Lookup ---
+        cache_key = _cache_key(data) if CACHE_ENABLED else None
+        report_text = await cache_get(cache_key) if cache_key else None
+
+        # --- Gemini Call (streamed, parsed as it arrives) ---
+        if report_text is None:
+            report_text, parsed_output = await stream_report(_FULL_TMPL.format(**msgspec.structs.asdict(data)))
+            if cache_key:
+                await cache_set(cache_key, report_text)
+        else:
+            parsed_output = parse_medical_report(report_text)
+
+        return Response(_REPORT_ENCODER.encode(parsed_output), media_type="application/json")
 
     except Exception as e:
 
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+
+@app.post(
+    "/predict_batch",
+    response_class=Response,
+    responses=_BATCH_RESPONSES,
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": _BATCH_SCHEMA}}}},
+)
+async def predict_batch(items: List[BiomarkerRequest] = Depends(decode_biomarker_batch)):
+    """Accepts a list of biomarker inputs and returns one structured report per patient."""
+    try:
+        chunks = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+        tasks = [asyncio.ensure_future(predict_chunk(chunk)) for chunk in chunks]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # one chunk failed: stop the remaining Gemini calls instead of discarding their results later
+            for task in tasks:
+                task.cancel()
+            raise
+
+        reports = [report for chunk in results for report in chunk]
+        return Response(_REPORT_ENCODER.encode(reports), media_type="application/json")
+
+    except Exception as e:
+
+        raise HTTPException(status_code=500, detail=f"Batch prediction error: {str(e)}")
+
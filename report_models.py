@@ -0,0 +1,28 @@
+import msgspec
+from typing import Dict, List
+
+# Output structs for parsed reports. Kept out of report_parser so that module
+# stays compilable with mypyc, which cannot compile msgspec.Struct subclasses.
+
+
+class ExecutiveSummary(msgspec.Struct):
+    top_priorities: List[str] = msgspec.field(default_factory=list)
+    key_strengths: List[str] = msgspec.field(default_factory=list)
+
+
+class BiomarkerRow(msgspec.Struct):
+    biomarker: str
+    value: str
+    status: str
+    insight: str
+    reference_range: str
+
+
+class ReportOut(msgspec.Struct):
+    """Structured medical report; encodes to the same JSON shape the API has always returned."""
+    executive_summary: ExecutiveSummary = msgspec.field(default_factory=ExecutiveSummary)
+    system_analysis: Dict[str, str] = msgspec.field(default_factory=dict)
+    personalized_action_plan: Dict[str, str] = msgspec.field(default_factory=dict)
+    interaction_alerts: List[str] = msgspec.field(default_factory=list)
+    normal_ranges: Dict[str, str] = msgspec.field(default_factory=dict)
+    biomarker_table: List[BiomarkerRow] = msgspec.field(default_factory=list)
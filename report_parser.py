@@ -0,0 +1,227 @@
+import re
+import string
+from typing import Callable, Dict, List, Optional
+
+from report_models import BiomarkerRow, ReportOut
+
+# Markdown report parsing, kept free of framework imports so it can be compiled
+# with mypyc (see README). Without a compiled build the plain module is used.
+
+
+# ---------------- Patterns ----------------
+# Compiled once at import so the per-request parsing path skips re's pattern cache.
+_PATIENT_RE = re.compile(r"#{3,}\s*Patient\s+(\d+)[^\n]*", re.I)
+_DASH_RE = re.compile(r"-{3,}")
+_BULLET_RE = re.compile(r"[\-\*\u2022]+\s*")
+_BOLD_RE = re.compile(r"\*\*(.*?)\*\*(.*?)(?=\*\*|###|$)", re.S)
+# one linear pass over the report: "### <header>" followed by its block, up to the next header.
+# Only exact H3 runs count, so "#### sub-headings" stay inside their section.
+_SECTION_RE = re.compile(r"(?<!#)###(?!#)[ \t]*([^\n]*)(.*?)(?=(?<!#)###(?!#)|\Z)", re.S)
+_PRIORITY_RE = re.compile(r"\d+\.\s*(.*?)\n")
+_STRENGTHS_RE = re.compile(r"\*\*Key Strengths:\*\*(.*)", re.S)
+_RANGE_RE = re.compile(r"-\s*([^:]+):\s*([^\n]+)")
+# robust row matcher: capture any table rows with 5 pipe-separated columns
+_TABLE_ROW_RE = re.compile(r"\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|\s*([^|]+)\s*\|")
+
+
+# ---------------- Cleaning Utility ----------------
+_STRIP_CHARS = " -\n\t\r"
+
+
+def _clean_str(text: str) -> str:
+    """Removes separators, extra whitespace, and artifacts from a single string value."""
+    text = " ".join(_DASH_RE.sub("", text).split())
+    return text.strip(_STRIP_CHARS)
+
+
+_ALNUM_CHARS = frozenset(string.ascii_letters + string.digits)
+
+
+def _is_separator_cell(cell: str) -> bool:
+    """Treats a table cell as a separator artifact if it contains no alphanumeric chars."""
+    return _ALNUM_CHARS.isdisjoint(cell)
+
+
+# ---------------- Parser ----------------
+def _clean_line(line: str) -> str:
+    line = line.strip()
+    if line.startswith("#"):
+        # markdown sub-heading inside a section, not a list item
+        return ""
+    return _clean_str(_BULLET_RE.sub("", line))
+
+
+def _parse_bold_entities(block: str) -> Dict[str, str]:
+    """Extracts **bold** entities and maps text until next bold or section."""
+    entities: Dict[str, str] = {}
+    for match in _BOLD_RE.finditer(block):
+        key = match.group(1).strip().strip(":").strip()
+        if key:
+            entities[key] = _clean_str(match.group(2))
+    return entities
+
+
+def _parse_executive_summary(block: str, report: ReportOut) -> None:
+    priorities = [p for p in (_clean_line(m.group(1)) for m in _PRIORITY_RE.finditer(block)) if p]
+    if priorities:
+        report.executive_summary.top_priorities = priorities
+    strengths_match = _STRENGTHS_RE.search(block)
+    if strengths_match:
+        strengths_text = strengths_match.group(1)
+        strengths = [s for s in map(_clean_line, strengths_text.splitlines()) if s]
+        report.executive_summary.key_strengths = strengths
+
+
+def _parse_system_analysis(block: str, report: ReportOut) -> None:
+    report.system_analysis = _parse_bold_entities(block)
+
+
+def _parse_action_plan(block: str, report: ReportOut) -> None:
+    report.personalized_action_plan = _parse_bold_entities(block)
+
+
+def _parse_interaction_alerts(block: str, report: ReportOut) -> None:
+    report.interaction_alerts = [a for a in map(_clean_line, block.splitlines()) if a]
+
+
+def _parse_normal_ranges(block: str, report: ReportOut) -> None:
+    for match in _RANGE_RE.finditer(block):
+        report.normal_ranges[match.group(1).strip()] = _clean_str(match.group(2))
+
+
+def _parse_tabular_mapping(block: str, report: ReportOut) -> None:
+    for row in _TABLE_ROW_RE.finditer(block):
+        # normalize
+        biomarker_s, value_s, status_s, insight_s, ref_s = (cell.strip() for cell in row.groups())
+
+        # ---------- ONLY SKIP rows where ALL five fields are empty ----------
+        if not any([biomarker_s, value_s, status_s, insight_s, ref_s]):
+            # This is the empty-row you showed: skip it and continue
+            continue
+
+        # ---------- ALSO SKIP rows that are pure separator artifacts ----------
+        # e.g., ":-----------" or "--------" in biomarker column (common AI artifacts)
+        if all(map(_is_separator_cell, (biomarker_s, value_s, status_s, insight_s, ref_s))):
+            continue
+
+        # ---------- Append the cleaned/valid row ----------
+        report.biomarker_table.append(BiomarkerRow(
+            biomarker=_clean_str(biomarker_s),
+            value=_clean_str(value_s),
+            status=_clean_str(status_s),
+            insight=_clean_str(insight_s),
+            reference_range=_clean_str(ref_s),
+        ))
+
+
+# normalized section-name prefix → parser for that section's block
+_SECTION_HANDLERS: Dict[str, Callable[[str, ReportOut], None]] = {
+    "executive summary": _parse_executive_summary,
+    "system specific analysis": _parse_system_analysis,
+    "personalized action plan": _parse_action_plan,
+    "interaction alerts": _parse_interaction_alerts,
+    "normal ranges": _parse_normal_ranges,
+    "tabular mapping": _parse_tabular_mapping,
+}
+
+
+def _section_name(header: str) -> str:
+    """Normalizes a section header, e.g. "System-Specific Analysis:" → "system specific analysis"."""
+    return header.strip().strip("*: ").lower().replace("-", " ")
+
+
+def _section_handler(header: str) -> Optional[Callable[[str, ReportOut], None]]:
+    """Finds the handler whose section name starts the header, e.g. "Normal Ranges (Reference)"."""
+    name = _section_name(header)
+    handler = _SECTION_HANDLERS.get(name)
+    if handler is None:
+        for prefix, candidate in _SECTION_HANDLERS.items():
+            if name.startswith(prefix):
+                return candidate
+    return handler
+
+
+def _parse_sections(text: str, report: ReportOut) -> None:
+    """Scans the section headers once and dispatches each block to its handler."""
+    for match in _SECTION_RE.finditer(text):
+        handler = _section_handler(match.group(1))
+        if handler:
+            handler(match.group(2), report)
+
+
+def parse_medical_report(text: str) -> ReportOut:
+    """
+    Parses Gemini markdown response → structured report.
+    Detects section headers, **bold keys**, and table entries.
+    """
+    report = ReportOut()
+    _parse_sections(text, report)
+    return report
+
+
+def _last_section_start(text: str) -> int:
+    """
+    Index of the last "###" header that starts a line, or -1.
+    A "###" later on a line may be part of that line's header text
+    (e.g. "### Interaction Alerts ###"), so it is never a safe place to cut.
+    """
+    cut = text.rfind("###")
+    while cut >= 0:
+        end = cut + 3
+        # the character after the run must have arrived to rule out "####"
+        if (cut == 0 or text[cut - 1] == "\n") and end < len(text) and text[end] != "#":
+            return cut
+        cut = text.rfind("###", 0, cut + 2)
+    return -1
+
+
+class StreamingReportParser:
+    """
+    Parses a Gemini report while it is still streaming in.
+    A section is dispatched as soon as the next "###" header arrives, so parsing
+    overlaps with the network instead of starting after the last chunk.
+    """
+
+    def __init__(self) -> None:
+        self.report = ReportOut()
+        self._chunks: List[str] = []
+        self._pending = ""
+
+    @property
+    def text(self) -> str:
+        """The full report text received so far."""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> None:
+        self._chunks.append(chunk)
+        pending = self._pending + chunk
+        # everything before the last header seen is a run of complete sections
+        cut = _last_section_start(pending)
+        if cut > 0:
+            _parse_sections(pending[:cut], self.report)
+            pending = pending[cut:]
+        self._pending = pending
+
+    def close(self) -> ReportOut:
+        """Parses the final section and returns the finished report."""
+        _parse_sections(self._pending.rstrip(), self.report)
+        self._pending = ""
+        return self.report
+
+
+# ---------------- Batch Splitting ----------------
+def split_patient_reports(text: str, count: int) -> List[str]:
+    """Splits a batched Gemini response on its "### Patient N" headers (any order), returned in patient order."""
+    headers = list(_PATIENT_RE.finditer(text))
+    ends = [header.start() for header in headers[1:]] + [len(text)]
+    reports: Dict[int, str] = {}
+    for header, end in zip(headers, ends):
+        number = int(header.group(1))
+        if number in reports:
+            raise ValueError(f"Gemini response contains more than one report for patient {number}.")
+        reports[number] = text[header.end():end]
+
+    missing = [i for i in range(1, count + 1) if i not in reports]
+    if missing:
+        raise ValueError(f"Gemini response is missing reports for patients {missing}.")
+    return [reports[i] for i in range(1, count + 1)]
@@ -0,0 +1,78 @@
+import os
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+client = TestClient(app.app)
+
+
+@pytest.mark.parametrize(
+    "path, body, loc, msg",
+    [
+        ("/predict", {"age": "x"}, ["body", "age"], "Expected `int`, got `str`"),
+        ("/predict_batch", [{}, {"glucose": [1]}], ["body", 1, "glucose"], "Expected `float`, got `array`"),
+        ("/predict_batch", [], ["body"], "Expected `array` of length >= 1"),
+    ],
+)
+def test_decode_errors_use_per_field_locations(path, body, loc, msg):
+    response = client.post(path, json=body)
+
+    assert response.status_code == 422
+    assert response.json() == {"detail": [{"loc": loc, "msg": msg, "type": "value_error"}]}
+
+
+def test_malformed_json_is_reported_on_body():
+    response = client.post("/predict", content=b"{bad")
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body"]
+
+
+class _Chunk:
+    def __init__(self, text, finish_reason=0):
+        self.text = text
+        self.parts = [text] if text else []
+        self.candidates = [type("Candidate", (), {"finish_reason": finish_reason})()]
+
+
+class _StreamingModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        async def stream():
+            for chunk in self.chunks:
+                yield chunk
+
+        return stream()
+
+
+REPORT = "### Interaction Alerts\n- High glucose and CRP may compound vascular risk.\n"
+
+
+@pytest.mark.parametrize("reason", ["SAFETY", "RECITATION", "MAX_TOKENS"])
+def test_incomplete_stream_is_an_error_and_not_cached(monkeypatch, reason):
+    finish = getattr(app.genai.protos.Candidate.FinishReason, reason)
+    monkeypatch.setattr(app, "model", _StreamingModel([_Chunk(REPORT), _Chunk("", finish)]))
+    monkeypatch.setattr(app, "CACHE_ENABLED", True)
+    monkeypatch.setattr(app, "_CACHE", app.OrderedDict())
+
+    response = client.post("/predict", json={})
+
+    assert response.status_code == 500
+    assert reason in response.json()["detail"]
+    assert not app._CACHE
+
+
+def test_completed_stream_returns_report(monkeypatch):
+    stop = app.genai.protos.Candidate.FinishReason.STOP
+    monkeypatch.setattr(app, "model", _StreamingModel([_Chunk(REPORT[:20]), _Chunk(REPORT[20:], stop)]))
+
+    response = client.post("/predict", json={})
+
+    assert response.status_code == 200
+    assert response.json()["interaction_alerts"] == ["High glucose and CRP may compound vascular risk."]
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+from report_parser import StreamingReportParser, parse_medical_report
+
+SAMPLE_REPORT = """
+------------------------------
+### Executive Summary
+**Top 3 Health Priorities:**
+1. **Elevated glucose** - fasting value of 145 mg/dL suggests hyperglycemia.
+2. Mild anemia with high RDW.
+3. Inflammation (CRP 12 mg/L).
+
+**Key Strengths:**
+- Normal MCV
+- Albumin near normal
+
+------------------------------
+### System-Specific Analysis
+#### Cardiovascular
+**Cardiovascular System**
+Status: Normal. Explanation: no
+   concerns.
+
+**Liver Function:**
+Status: Elevated ALP. Explanation: monitor.
+------------------------------
+### Personalized Action Plan
+**Nutrition:** Reduce refined carbs.
+**Lifestyle:** Walk 30 min daily.
+
+------------------------------
+### Interaction Alerts
+- High glucose and CRP may compound vascular risk.
+#### Secondary
+- Anemia plus RDW elevation.
+
+------------------------------
+### Normal Ranges
+- Albumin: 3.5–5.0 g/dL
+- Creatinine: 0.7–1.3 mg/dL
+
+------------------------------
+### Tabular Mapping
+| Biomarker | Value | Status | Insight | Reference Range |
+|:-----------|:------|:-----|:----|:---|
+| Albumin | 3.2 | Low | Slightly low | 3.5–5.0 g/dL |
+| Glucose | 145 | High | Hyperglycemia | 70–100 mg/dL |
+------------------------------
+"""
+
+
+def _stream(text: str, seed: int) -> StreamingReportParser:
+    rng = random.Random(seed)
+    parser = StreamingReportParser()
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 40)
+        parser.feed(text[pos:pos + size])
+        pos += size
+    return parser
+
+
+# header variants whose "###" also appears later on the header line
+REPORT_VARIANTS = {
+    "sample": SAMPLE_REPORT,
+    "closing_hashes": SAMPLE_REPORT.replace("### Interaction Alerts\n", "### Interaction Alerts ###\n"),
+    "hashes_in_header": SAMPLE_REPORT.replace("### Normal Ranges\n", "### Normal Ranges (see ### notes)\n"),
+}
+
+
+@pytest.mark.parametrize("variant", sorted(REPORT_VARIANTS))
+@pytest.mark.parametrize("seed", range(200))
+def test_streamed_parse_matches_full_parse(variant, seed):
+    text = REPORT_VARIANTS[variant]
+    parser = _stream(text, seed)
+
+    assert parser.close() == parse_medical_report(text.strip())
+    assert parser.text == text
+
+
+@pytest.mark.parametrize("variant", sorted(REPORT_VARIANTS))
+def test_streamed_sections_keep_their_content(variant):
+    report = _stream(REPORT_VARIANTS[variant], 0).close()
+
+    assert report.system_analysis == {
+        "Cardiovascular System": "Status: Normal. Explanation: no concerns.",
+        "Liver Function": "Status: Elevated ALP. Explanation: monitor.",
+    }
+    assert report.interaction_alerts == [
+        "High glucose and CRP may compound vascular risk.",
+        "Anemia plus RDW elevation.",
+    ]
+    assert report.normal_ranges == {"Albumin": "3.5–5.0 g/dL", "Creatinine": "0.7–1.3 mg/dL"}
+
+
+def test_sub_heading_inside_table_keeps_rows():
+    text = SAMPLE_REPORT.replace(
+        "### Tabular Mapping\n", "### Tabular Mapping\n#### Blood panel\n"
+    )
+
+    rows = parse_medical_report(text).biomarker_table
+
+    assert [row.biomarker for row in rows] == ["Biomarker", "Albumin", "Glucose"]
@@ -0,0 +1,29 @@
+import pytest
+
+from report_parser import split_patient_reports
+
+
+def test_reports_are_returned_in_patient_order():
+    text = "### Patient 2\nsecond\n### Patient 1\nfirst\n### Patient 3\nthird"
+
+    assert [r.strip() for r in split_patient_reports(text, 3)] == ["first", "second", "third"]
+
+
+def test_missing_patient_raises():
+    text = "### Patient 1\nfirst\n### Patient 3\nthird"
+
+    with pytest.raises(ValueError, match=r"\[2\]"):
+        split_patient_reports(text, 3)
+
+
+def test_duplicate_patient_number_raises():
+    text = "### Patient 1\nfirst\n### Patient 1\nagain\n### Patient 2\nsecond"
+
+    with pytest.raises(ValueError, match="patient 1"):
+        split_patient_reports(text, 2)
+
+
+def test_deeper_patient_headings_are_accepted():
+    text = "#### Patient 1\nfirst\n#### Patient 2\nsecond"
+
+    assert [r.strip() for r in split_patient_reports(text, 2)] == ["first", "second"]